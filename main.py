@@ -3,17 +3,33 @@ import time
 import boto3
 import asyncio
 import re
+import string
 import base64
-from threading import Thread
-from flask import Flask, render_template
-from pyrogram import Client, filters
+import gzip
+import mimetypes
+import functools
+import importlib.util
+import itertools
+import operator
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from boto3.s3.transfer import S3Transfer, TransferConfig
+from botocore.config import Config
+from flask import Flask, Response, render_template, request
+from pyrogram import Client, filters, idle
+from pyrogram.handlers import MessageHandler
 from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
 from pyrogram.errors import FloodWait
 from dotenv import load_dotenv
+from werkzeug.serving import WSGIRequestHandler
 import logging
-from collections import defaultdict
-from datetime import datetime, timedelta
+from collections import OrderedDict, defaultdict, deque
+from contextlib import suppress
+from dataclasses import dataclass
 import botocore
+import requests
+from urllib.parse import urlparse
 
 # Set up logging
 logging.basicConfig(
@@ -26,101 +42,307 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Configuration
-API_ID = os.getenv("API_ID")
-API_HASH = os.getenv("API_HASH")
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-WASABI_ACCESS_KEY = os.getenv("WASABI_ACCESS_KEY")
-WASABI_SECRET_KEY = os.getenv("WASABI_SECRET_KEY")
-WASABI_BUCKET = os.getenv("WASABI_BUCKET")
-WASABI_REGION = os.getenv("WASABI_REGION", "us-east-1")
-RENDER_URL = os.getenv("RENDER_URL", "http://localhost:8000")
-MAX_FILE_SIZE = 2000 * 1024 * 1024  # 2GB
+@dataclass(frozen=True)
+class Env:
+    """Environment settings, read once at import"""
+    api_id: str
+    api_hash: str
+    bot_token: str
+    wasabi_access_key: str
+    wasabi_secret_key: str
+    wasabi_bucket: str
+    wasabi_region: str
+    render_url: str
+    session_name: str
+    session_dir: str
 
-# Validate environment variables
-missing_vars = []
-for var_name, var_value in [
-    ("API_ID", API_ID),
-    ("API_HASH", API_HASH),
-    ("BOT_TOKEN", BOT_TOKEN),
-    ("WASABI_ACCESS_KEY", WASABI_ACCESS_KEY),
-    ("WASABI_SECRET_KEY", WASABI_SECRET_KEY),
-    ("WASABI_BUCKET", WASABI_BUCKET)
-]:
-    if not var_value:
-        missing_vars.append(var_name)
-
-if missing_vars:
-    raise Exception(f"Missing environment variables: {', '.join(missing_vars)}")
-
-# Initialize clients
-app = Client("wasabi_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
-
-# Configure Wasabi S3 client
-try:
-    wasabi_endpoint_url = f'https://s3.{WASABI_REGION}.wasabisys.com'
-    
-    # Wasabi requires special configuration
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=wasabi_endpoint_url,
-        aws_access_key_id=WASABI_ACCESS_KEY,
-        aws_secret_access_key=WASABI_SECRET_KEY,
-        region_name=WASABI_REGION,
-        config=boto3.session.Config(
-            s3={'addressing_style': 'virtual'},
-            signature_version='s3v4'
+    @classmethod
+    def from_environ(cls):
+        return cls(
+            api_id=os.getenv("API_ID"),
+            api_hash=os.getenv("API_HASH"),
+            bot_token=os.getenv("BOT_TOKEN"),
+            wasabi_access_key=os.getenv("WASABI_ACCESS_KEY"),
+            wasabi_secret_key=os.getenv("WASABI_SECRET_KEY"),
+            wasabi_bucket=os.getenv("WASABI_BUCKET"),
+            wasabi_region=os.getenv("WASABI_REGION", "us-east-1"),
+            render_url=os.getenv("RENDER_URL", "http://localhost:8000"),
+            session_name=os.getenv("SESSION_NAME", "wasabi_bot"),
+            session_dir=os.getenv("SESSION_DIR", ".")
         )
-    )
-    
-    # Test connection
-    s3_client.head_bucket(Bucket=WASABI_BUCKET)
-    logger.info("Successfully connected to Wasabi bucket")
-    
-except Exception as e:
-    logger.error(f"Wasabi connection failed: {e}")
-    # Try alternative endpoint format (some regions use different formats)
+
+    def missing(self):
+        """Names of required variables that are unset"""
+        return [
+            var_name for var_name, var_value in [
+                ("API_ID", self.api_id),
+                ("API_HASH", self.api_hash),
+                ("BOT_TOKEN", self.bot_token),
+                ("WASABI_ACCESS_KEY", self.wasabi_access_key),
+                ("WASABI_SECRET_KEY", self.wasabi_secret_key),
+                ("WASABI_BUCKET", self.wasabi_bucket)
+            ]
+            if not var_value
+        ]
+
+ENV = Env.from_environ()
+MAX_FILE_SIZE = 2000 * 1024 * 1024  # 2GB
+
+# Parallel Telegram file transfers (Pyrogram defaults to one at a time)
+TG_CONCURRENT_TRANSMISSIONS = int(os.getenv("TG_CONCURRENT_TRANSMISSIONS", "8"))
+
+# Blocking S3 transfers run on this pool so the Pyrogram event loop stays responsive
+S3_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="s3")
+# Parallel upload_part calls per streamed upload; also caps buffered parts in memory
+STREAM_PARTS_IN_FLIGHT = int(os.getenv("STREAM_PARTS_IN_FLIGHT", "8"))
+STREAM_UPLOADS = os.getenv("STREAM_UPLOADS", "true").lower() in ("1", "true", "yes")
+def shm_fits(size):
+    """Whether /dev/shm exists and has room for a file of this size"""
+    try:
+        stats = os.statvfs("/dev/shm")
+    except (OSError, AttributeError):
+        return False
+    return stats.f_bavail * stats.f_frsize >= size
+
+# Staging area for the STREAM_UPLOADS=false path; RAM-backed when /dev/shm can hold
+# a maximum-size file (Docker only gives containers 64 MB of it by default).
+# The trailing separator tells Pyrogram this is a directory.
+DOWNLOAD_DIR = os.path.join(
+    os.getenv("DOWNLOAD_DIR") or ("/dev/shm/wasabibot" if shm_fits(MAX_FILE_SIZE) else "./downloads"),
+    ""
+)
+# One part size for both upload paths; S3 needs >= 5 MiB for every part but the last
+MULTIPART_CHUNK_SIZE = max(int(os.getenv("S3_CHUNK_MB", "16")), 5) * 1024 * 1024
+# Parallel part uploads per file for the on-disk path
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "10"))
+# Optional flexible checksum overriding botocore's default CRC32. CRC32C is only
+# implemented by aws-crt (boto3[crt]), which also speeds up the others.
+S3_CHECKSUM_ALGORITHMS = ("CRC32", "CRC32C", "SHA1", "SHA256")
+S3_CHECKSUM_ALGORITHM = os.getenv("S3_CHECKSUM_ALGORITHM", "").upper() or None
+UPLOAD_EXTRA_ARGS = {"ChecksumAlgorithm": S3_CHECKSUM_ALGORITHM} if S3_CHECKSUM_ALGORITHM else {}
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=MULTIPART_CHUNK_SIZE,
+    max_concurrency=S3_MAX_CONCURRENCY,
+    max_io_queue=100,
+    use_threads=True
+)
+
+# http.client sends file-like bodies in blocksize reads, taking and releasing the
+# GIL on each one; 8 KiB blocks starve parallel part uploads of CPU
+HTTP_BLOCKSIZE = int(os.getenv("BOT_HTTP_BLOCKSIZE", str(1024 * 1024)))
+
+def set_http_blocksize(blocksize):
+    """Make new HTTP(S) connections (http.client and urllib3) use a larger send block"""
+    # Positional default on http.client.HTTPConnection; replace only the stock 8192
+    init = http.client.HTTPConnection.__init__
+    init.__defaults__ = tuple(blocksize if value == 8192 else value for value in init.__defaults__)
+
+    # The HTTPS classes, and urllib3 2.x's, declare their own keyword-only default;
+    # botocore's AWSHTTPSConnection inherits urllib3's HTTPSConnection one
+    connection_classes = [http.client.HTTPSConnection]
+    with suppress(ImportError):
+        import urllib3.connection
+        connection_classes += [urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection]
+    for connection_class in connection_classes:
+        kwdefaults = connection_class.__init__.__kwdefaults__ or {}
+        if "blocksize" in kwdefaults:
+            kwdefaults["blocksize"] = blocksize
+
+if HTTP_BLOCKSIZE > 0:
+    set_http_blocksize(HTTP_BLOCKSIZE)
+
+# Keep TLS connections to Wasabi warm and large enough for parallel parts
+S3_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.getenv("S3_POOL_SIZE", "64")),
+    connect_timeout=3,
+    read_timeout=60,
+    retries={'mode': 'adaptive', 'max_attempts': 5},
+    tcp_keepalive=True
+)
+
+@functools.cache
+def get_s3_client():
+    """Create the Wasabi S3 client on first use and check the bucket is reachable"""
     try:
-        wasabi_endpoint_url = f'https://{WASABI_BUCKET}.s3.{WASABI_REGION}.wasabisys.com'
+        wasabi_endpoint_url = f'https://s3.{ENV.wasabi_region}.wasabisys.com'
+        
+        # Wasabi requires special configuration
         s3_client = boto3.client(
             's3',
             endpoint_url=wasabi_endpoint_url,
-            aws_access_key_id=WASABI_ACCESS_KEY,
-            aws_secret_access_key=WASABI_SECRET_KEY,
-            region_name=WASABI_REGION
+            aws_access_key_id=ENV.wasabi_access_key,
+            aws_secret_access_key=ENV.wasabi_secret_key,
+            region_name=ENV.wasabi_region,
+            config=S3_CLIENT_CONFIG.merge(Config(
+                s3={'addressing_style': 'virtual'},
+                signature_version='s3v4'
+            ))
         )
-        s3_client.head_bucket(Bucket=WASABI_BUCKET)
-        logger.info("Successfully connected to Wasabi bucket with alternative endpoint")
-    except Exception as alt_e:
-        logger.error(f"Alternative connection also failed: {alt_e}")
-        raise Exception(f"Could not connect to Wasabi: {alt_e}")
+        
+        # Test connection
+        s3_client.head_bucket(Bucket=ENV.wasabi_bucket)
+        logger.info("Successfully connected to Wasabi bucket")
+        return s3_client
+        
+    except Exception as e:
+        logger.error(f"Wasabi connection failed: {e}")
+        # Try alternative endpoint format (some regions use different formats)
+        try:
+            wasabi_endpoint_url = f'https://{ENV.wasabi_bucket}.s3.{ENV.wasabi_region}.wasabisys.com'
+            s3_client = boto3.client(
+                's3',
+                endpoint_url=wasabi_endpoint_url,
+                aws_access_key_id=ENV.wasabi_access_key,
+                aws_secret_access_key=ENV.wasabi_secret_key,
+                region_name=ENV.wasabi_region,
+                config=S3_CLIENT_CONFIG
+            )
+            s3_client.head_bucket(Bucket=ENV.wasabi_bucket)
+            logger.info("Successfully connected to Wasabi bucket with alternative endpoint")
+            return s3_client
+        except Exception as alt_e:
+            logger.error(f"Alternative connection also failed: {alt_e}")
+            raise Exception(f"Could not connect to Wasabi: {alt_e}")
+
+@functools.cache
+def get_s3_transfer():
+    """One transfer manager for every on-disk upload.
+
+    client.upload_file builds a fresh S3Transfer, with its own thread pool, on
+    every call; sharing one keeps those threads and the client's pool warm.
+    """
+    return S3Transfer(client=get_s3_client(), config=TRANSFER_CONFIG)
 
 # -----------------------------
 # Flask app for player.html
 # -----------------------------
 flask_app = Flask(__name__, template_folder="templates")
 
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """Speak HTTP/1.1 so browsers reuse the connection for follow-up requests"""
+    protocol_version = "HTTP/1.1"
+
+@functools.cache
+def render_page(template_name):
+    """Render and encode a page once; none of the templates depend on request data.
+
+    player.html reads the media URL from the path in the browser, so the same
+    HTML serves every player link.
+    """
+    return render_template(template_name).encode("utf-8")
+
+@functools.cache
+def render_page_gzip(template_name):
+    """Gzip a rendered page once, for clients that accept it"""
+    return gzip.compress(render_page(template_name), compresslevel=6)
+
+def page_response(template_name):
+    # A bytes body gets an exact Content-Length, which keep-alive relies on
+    if request.accept_encodings["gzip"] > 0:
+        response = Response(render_page_gzip(template_name), mimetype="text/html")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(render_page(template_name), mimetype="text/html")
+    response.vary.add("Accept-Encoding")
+    return response
+
 @flask_app.route("/")
 def index():
-    return render_template("index.html")
+    return page_response("index.html")
+
+def decode_media_url(encoded_url):
+    """Decode the unpadded urlsafe-base64 media URL carried in player links"""
+    # Add padding if needed for base64 decoding
+    padding = 4 - (len(encoded_url) % 4)
+    if padding != 4:
+        encoded_url += '=' * padding
+    return base64.urlsafe_b64decode(encoded_url).decode()
 
 @flask_app.route("/player/<media_type>/<encoded_url>")
 def player(media_type, encoded_url):
     try:
-        # Add padding if needed for base64 decoding
-        padding = 4 - (len(encoded_url) % 4)
-        if padding != 4:
-            encoded_url += '=' * padding
-        media_url = base64.urlsafe_b64decode(encoded_url).decode()
-        return render_template("player.html", media_type=media_type, media_url=media_url)
+        decode_media_url(encoded_url)
+        return page_response("player.html")
     except Exception as e:
         return f"Error decoding URL: {str(e)}", 400
 
+# Pooled connections to Wasabi for the ranged stream proxy
+stream_session = requests.Session()
+STREAM_RANGE_CAP = 8 * 1024 * 1024
+STREAM_PASSTHROUGH_HEADERS = ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+
+def is_bucket_url(parsed_url):
+    """Whether a URL points into this bot's bucket, in virtual-host or path style"""
+    if parsed_url.scheme != "https":
+        return False
+    bucket = ENV.wasabi_bucket.lower()
+    region_host = f"s3.{ENV.wasabi_region}.wasabisys.com".lower()
+    return (
+        parsed_url.hostname == f"{bucket}.{region_host}"
+        or (parsed_url.hostname == region_host and parsed_url.path.startswith(f"/{ENV.wasabi_bucket}/"))
+    )
+
+@flask_app.route("/stream/<encoded_url>")
+def stream(encoded_url):
+    """Proxy the player's Range requests to Wasabi as bounded ranged GETs"""
+    try:
+        media_url = decode_media_url(encoded_url)
+    except Exception as e:
+        return f"Error decoding URL: {str(e)}", 400
+
+    # Only links into our own bucket may be proxied, or this becomes an open relay
+    if not is_bucket_url(urlparse(media_url)):
+        return "Unsupported media URL", 400
+
+    headers = {}
+    range_header = request.headers.get("Range")
+    if range_header:
+        # Cap open-ended "bytes=X-" seeks so Wasabi serves a bounded range
+        match = re.fullmatch(r"bytes=(\d+)-", range_header.strip())
+        if match:
+            start = int(match.group(1))
+            range_header = f"bytes={start}-{start + STREAM_RANGE_CAP - 1}"
+        headers["Range"] = range_header
+
+    try:
+        upstream = stream_session.get(media_url, headers=headers, stream=True, timeout=30)
+    except requests.RequestException as e:
+        logger.error(f"Stream upstream error: {e}")
+        return "Could not reach storage", 502
+    response_headers = {
+        name: upstream.headers[name]
+        for name in STREAM_PASSTHROUGH_HEADERS
+        if name in upstream.headers
+    }
+    response_headers.setdefault("Accept-Ranges", "bytes")
+
+    def generate():
+        with upstream:
+            yield from upstream.iter_content(chunk_size=64 * 1024)
+
+    return Response(generate(), status=upstream.status_code, headers=response_headers)
+
+# Probes hit this every few seconds; the body never changes
+HEALTH_RESPONSE_BODY = b'{"status":"healthy","service":"wasabi-storage-bot"}'
+
+@flask_app.route("/health")
+def health():
+    return Response(HEALTH_RESPONSE_BODY, mimetype="application/json")
+
 @flask_app.route("/about")
 def about():
-    return render_template("about.html")
+    return page_response("about.html")
 
 def run_flask():
-    flask_app.run(host="0.0.0.0", port=8000, debug=False)
+    # One thread per request, so a slow client never blocks other player pages
+    flask_app.run(
+        host="0.0.0.0",
+        port=8000,
+        debug=False,
+        threaded=True,
+        request_handler=KeepAliveRequestHandler
+    )
 
 # -----------------------------
 # Helper Functions
@@ -131,37 +353,54 @@ MEDIA_EXTENSIONS = {
     'image': ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
 }
 
+# Extension -> media type, so classifying a file is a single dict lookup
+_EXTENSION_TYPES = {
+    ext: file_type
+    for file_type, extensions in MEDIA_EXTENSIONS.items()
+    for ext in extensions
+}
+
 def get_file_type(filename):
-    ext = os.path.splitext(filename)[1].lower()
-    for file_type, extensions in MEDIA_EXTENSIONS.items():
-        if ext in extensions:
-            return file_type
-    return 'other'
+    name, dot, ext = filename.rpartition('.')
+    if not dot or not name.lstrip('.'):
+        return 'other'  # No extension, or a dotfile such as ".mp4"
+    return _EXTENSION_TYPES.get('.' + ext.lower(), 'other')
 
+PLAYER_BASE_URL = f"{ENV.render_url}/player/" if ENV.render_url else None
+
+# Presigned URLs are reused from cache, so the same pair recurs across commands
+@functools.lru_cache(maxsize=2048)
 def generate_player_url(filename, presigned_url):
-    if not RENDER_URL:
+    if not PLAYER_BASE_URL:
         return None
     file_type = get_file_type(filename)
-    if file_type in ['video', 'audio', 'image']:
+    if file_type in ('video', 'audio', 'image'):
         encoded_url = base64.urlsafe_b64encode(presigned_url.encode()).decode().rstrip('=')
-        return f"{RENDER_URL}/player/{file_type}/{encoded_url}"
+        return f"{PLAYER_BASE_URL}{file_type}/{encoded_url}"
     return None
 
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+
 def humanbytes(size):
     """Convert bytes to human readable format"""
     if not size:
         return "0 B"
-    power = 1024
-    units = ["B", "KB", "MB", "GB", "TB"]
-    for unit in units:
-        if size < power:
-            return f"{size:.2f} {unit}"
-        size /= power
-    return f"{size:.2f} TB"
+    # Each unit is 2**10 of the previous one, so the bit length picks it directly
+    index = min(max((int(size).bit_length() - 1) // 10, 0), len(_SIZE_UNITS) - 1)
+    return f"{size / (1 << (index * 10)):.2f} {_SIZE_UNITS[index]}"
+
+_SAFE_FILENAME_CHARS = frozenset(string.ascii_letters + string.digits + ' _.-')
+_UNSAFE_ASCII_TABLE = str.maketrans({
+    c: '_' for c in map(chr, range(128)) if c not in _SAFE_FILENAME_CHARS
+})
+_UNSAFE_FILENAME_RE = re.compile(r'[^a-zA-Z0-9 _.-]')
 
 def sanitize_filename(filename):
     """Remove potentially dangerous characters from filenames"""
-    filename = re.sub(r'[^a-zA-Z0-9 _.-]', '_', filename)
+    if filename.isascii():
+        filename = filename.translate(_UNSAFE_ASCII_TABLE)
+    else:
+        filename = _UNSAFE_FILENAME_RE.sub('_', filename)
     if len(filename) > 200:
         name, ext = os.path.splitext(filename)
         filename = name[:200-len(ext)] + ext
@@ -181,54 +420,450 @@ def create_download_keyboard(presigned_url, player_url=None):
     
     return InlineKeyboardMarkup(keyboard)
 
+# Every 20-cell bar the progress messages can show, built once at import
+_PROGRESS_BARS = tuple('█' * filled + '○' * (20 - filled) for filled in range(21))
+
 def create_progress_bar(percentage, length=20):
     """Create a visual progress bar"""
-    filled = int(length * percentage / 100)
-    empty = length - filled
-    return '█' * filled + '○' * empty
+    filled = min(max(int(length * percentage / 100), 0), length)
+    if length == 20:
+        return _PROGRESS_BARS[filled]
+    return '█' * filled + '○' * (length - filled)
 
 def format_eta(seconds):
     """Format seconds into human readable ETA"""
+    seconds = int(seconds)
     if seconds <= 0:
         return "00:00"
-    hours, remainder = divmod(seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    if hours > 0:
-        return f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
-    return f"{int(minutes):02d}:{int(seconds):02d}"
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
 
 def format_elapsed(seconds):
     """Format elapsed time"""
-    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+def format_expiry(expires_at):
+    """Format the time left on a link, e.g. 23h 41m"""
+    minutes = max(int(expires_at - time.time()) // 60, 0)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m"
+
+class TransferProgress:
+    """Track bytes moved by a transfer and report them from the event loop.
+
+    Producers only record the byte count (boto3 calls ``add`` from its transfer
+    threads, Pyrogram progress calls ``set``); a single ``pump`` task renders the
+    latest state, so at most one edit is ever in flight per status message.
+    """
+
+    def __init__(self, status_message, total_size, interval=2, title="📤 Uploading to Wasabi..."):
+        self.status_message = status_message
+        self.title = title
+        self.total_size = total_size
+        self.interval = interval
+        self.transferred = 0
+        self.start_time = time.time()
+        # s3transfer calls add() from several worker threads at once
+        self._lock = Lock()
+        self._total_str = humanbytes(total_size)
+        self._last_filled = -1
+        self._last_edit_time = 0
+
+    def add(self, bytes_amount):
+        with self._lock:
+            self.transferred += bytes_amount
+
+    def set(self, current):
+        self.transferred = current
+
+    def render(self):
+        transferred = min(self.transferred, self.total_size)
+        percentage = (transferred / self.total_size) * 100 if self.total_size else 100
+        elapsed_time = time.time() - self.start_time
+        speed = transferred / elapsed_time if elapsed_time > 0 else 0
+        eta = (self.total_size - transferred) / speed if speed > 0 else 0
+        return (
+            f"{self.title}\n"
+            f"[{create_progress_bar(percentage)}] {percentage:.1f}%\n"
+            f"Processed: {humanbytes(transferred)} of {self._total_str}\n"
+            f"Speed: {humanbytes(speed)}/s | ETA: {format_eta(eta)}\n"
+            f"Elapsed: {format_elapsed(elapsed_time)}"
+        )
+
+    def filled_cells(self):
+        """Number of filled cells in the 20-cell progress bar"""
+        if not self.total_size:
+            return 20
+        return min(self.transferred, self.total_size) * 20 // self.total_size
+
+    async def pump(self):
+        delay = self.interval
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.interval
+
+            # Skip frames where the bar has not moved, refreshing stats every 10s
+            filled = self.filled_cells()
+            current_time = time.time()
+            if filled == self._last_filled and current_time - self._last_edit_time < 10:
+                continue
+
+            try:
+                await self.status_message.edit_text(self.render())
+                self._last_filled = filled
+                self._last_edit_time = current_time
+            except FloodWait as e:
+                # Back off instead of queueing more edits behind the flood wait
+                delay = max(e.value, self.interval)
+            except Exception:
+                pass  # Ignore other errors during progress updates
+
+# (key, expires_in) -> (url, expires_at); links are reused until a sixth of their
+# lifetime (at most an hour) is left, so users never receive a nearly-expired one
+PRESIGNED_URL_CACHE_SIZE = 4096
+presigned_url_cache = OrderedDict()
+
+async def generate_presigned_url(key, expires_in=86400):
+    """Sign a GET link for an object without blocking the event loop.
+
+    Returns (url, expires_at); a reused link has less than expires_in left.
+    """
+    now = time.time()
+    cached = presigned_url_cache.get((key, expires_in))
+    if cached and cached[1] - now > min(3600, expires_in // 6):
+        # Hot links stay at the back, so eviction drops the least recently used
+        presigned_url_cache.move_to_end((key, expires_in))
+        return cached
+
+    url = await asyncio.to_thread(
+        get_s3_client().generate_presigned_url,
+        'get_object',
+        Params={'Bucket': ENV.wasabi_bucket, 'Key': key},
+        ExpiresIn=expires_in
+    )
+    presigned_url_cache.pop((key, expires_in), None)
+    if len(presigned_url_cache) >= PRESIGNED_URL_CACHE_SIZE:
+        presigned_url_cache.popitem(last=False)
+    presigned_url_cache[(key, expires_in)] = (url, now + expires_in)
+    return url, now + expires_in
+
+# user_id -> (fetched_at, file names); an insertion-ordered dict keeps /list
+# oldest-first by upload time and gives /play and /download O(1) existence checks
+USER_FILES_TTL = 30
+FILES_PER_PAGE = 15
+user_files_cache = {}
+user_files_locks = defaultdict(asyncio.Lock)
+
+def list_user_files(user_id):
+    """Fetch the names of a user's files (blocking)"""
+    user_prefix = get_user_folder(user_id) + "/"
+    prefix_length = len(user_prefix)
+    # list_objects_v2 stops at 1000 keys per call; the paginator follows continuation tokens
+    pages = get_s3_client().get_paginator('list_objects_v2').paginate(
+        Bucket=ENV.wasabi_bucket,
+        Prefix=user_prefix
+    )
+    objects = [obj for page in pages for obj in page.get('Contents', [])]
+    objects.sort(key=operator.itemgetter('LastModified'))
+    return dict.fromkeys(obj['Key'][prefix_length:] for obj in objects)
+
+user_files_pruned_at = 0
+
+def prune_user_files():
+    """Drop expired listings and idle users' locks, at most once per USER_FILES_TTL"""
+    global user_files_pruned_at
+    now = time.time()
+    if now - user_files_pruned_at < USER_FILES_TTL:
+        return
+    user_files_pruned_at = now
+
+    for user_id in [uid for uid, cached in user_files_cache.items() if now - cached[0] > USER_FILES_TTL]:
+        del user_files_cache[user_id]
+    # A held lock has a listing in flight; it goes on a later pass
+    for user_id in [uid for uid, lock in user_files_locks.items()
+                    if uid not in user_files_cache and not lock.locked()]:
+        del user_files_locks[user_id]
+
+async def get_user_files(user_id):
+    """Return a user's file names, listing Wasabi at most once per USER_FILES_TTL"""
+    async with user_files_locks[user_id]:
+        cached = user_files_cache.get(user_id)
+        if not cached or time.time() - cached[0] > USER_FILES_TTL:
+            # Refreshes are the only writes, so they also keep the caches from
+            # growing with every user who ever ran a command
+            prune_user_files()
+            cached = (time.time(), await asyncio.to_thread(list_user_files, user_id))
+            user_files_cache[user_id] = cached
+    return cached[1]
+
+# Uploads and deletes patch a cached listing in place rather than dropping it,
+# so the next /list, /play or /download does not have to list Wasabi again
+def add_user_file(user_id, file_name):
+    cached = user_files_cache.get(user_id)
+    if cached:
+        cached[1].pop(file_name, None)  # A re-upload moves to the end, like a new file
+        cached[1][file_name] = None
+
+def remove_user_file(user_id, file_name):
+    cached = user_files_cache.get(user_id)
+    if cached:
+        cached[1].pop(file_name, None)
+
+async def user_has_file(user_id, file_name):
+    """Check a file exists, using the cached listing before asking Wasabi"""
+    if file_name in await get_user_files(user_id):
+        return True
+
+    # The listing may be stale, so confirm a miss with HEAD
+    try:
+        await asyncio.to_thread(
+            get_s3_client().head_object,
+            Bucket=ENV.wasabi_bucket,
+            Key=f"{get_user_folder(user_id)}/{file_name}"
+        )
+        return True
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return False
+        raise
+
+def get_media_file_name(message, media):
+    """Pick a safe object name for an incoming Telegram attachment"""
+    file_name = getattr(media, "file_name", None)
+    if not file_name:
+        mime_type = getattr(media, "mime_type", None)
+        extension = mimetypes.guess_extension(mime_type) if mime_type else None
+        if not extension:
+            extension = ".jpg" if message.photo else ""
+        file_name = f"{media.file_unique_id}{extension}"
+    return sanitize_filename(file_name)
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+def stream_part_size(file_size):
+    """Pick a part size that gives every upload slot several parts of the file.
+
+    Small files are split below MULTIPART_CHUNK_SIZE (down to S3's 5 MiB minimum)
+    so they still fill STREAM_PARTS_IN_FLIGHT; large files keep the configured
+    size, which bounds memory per upload.
+    """
+    target = -(-file_size // (STREAM_PARTS_IN_FLIGHT * 4))
+    return min(max(target, S3_MIN_PART_SIZE), MULTIPART_CHUNK_SIZE)
+
+async def stream_to_wasabi(client, message, key, progress, file_size, part_size=MULTIPART_CHUNK_SIZE):
+    """Pipe a Telegram file straight into a Wasabi multipart upload.
+
+    Telegram chunks are buffered into part_size parts; up to
+    STREAM_PARTS_IN_FLIGHT parts upload on the S3 executor while the next one
+    is being downloaded, so nothing is written to local disk and at most that
+    many parts are held in memory. A file that fits in one part is sent with a
+    single put_object instead. Nothing is committed unless exactly file_size
+    bytes arrived from Telegram.
+    """
+    s3_client = get_s3_client()
+    part_slots = asyncio.Semaphore(STREAM_PARTS_IN_FLIGHT)
+
+    # Executor futures of the S3 calls, so a failed upload can wait for PUTs that
+    # are already running (cancelling their tasks does not stop the threads)
+    s3_futures = []
+
+    def run_s3(method, **kwargs):
+        future = S3_EXECUTOR.submit(
+            functools.partial(method, Bucket=ENV.wasabi_bucket, Key=key, **kwargs)
+        )
+        s3_futures.append(future)
+        return asyncio.wrap_future(future)
+
+    async def upload_part(part_number, body):
+        try:
+            response = await run_s3(
+                s3_client.upload_part,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+                **UPLOAD_EXTRA_ARGS
+            )
+        finally:
+            part_slots.release()
+        if len(body) == part_size:
+            free_buffers.append(body)
+        progress.add(len(body))
+        part = {"PartNumber": part_number, "ETag": response["ETag"]}
+        if S3_CHECKSUM_ALGORITHM:
+            checksum_key = f"Checksum{S3_CHECKSUM_ALGORITHM}"
+            part[checksum_key] = response[checksum_key]
+        return part
+
+    async def submit_part(part_number, body):
+        nonlocal upload_id
+        if upload_id is None:
+            # Only opened once a second part is known to exist
+            upload_id = (await run_s3(s3_client.create_multipart_upload, **UPLOAD_EXTRA_ARGS))["UploadId"]
+        await part_slots.acquire()
+        # Stop pulling from Telegram as soon as any earlier part has failed
+        for task in part_tasks:
+            if task.done() and task.exception():
+                part_slots.release()
+                raise task.exception()
+        part_tasks.append(asyncio.create_task(upload_part(part_number, body)))
+
+    # Full parts go back here once uploaded, so a long upload cycles through a
+    # few fixed buffers instead of allocating and copying one per part
+    free_buffers = []
+
+    def take_buffer():
+        return free_buffers.pop() if free_buffers else bytearray(part_size)
+
+    upload_id = None
+    part_tasks = []
+    try:
+        part_number = 1
+        buffer = take_buffer()
+        filled = 0
+        streamed = 0
+        async for chunk in client.stream_media(message):
+            streamed += len(chunk)
+            view = memoryview(chunk)
+            while view:
+                # A full buffer is sent only once more data arrives, so the last
+                # part is always still in hand when the stream ends
+                if filled == part_size:
+                    await submit_part(part_number, buffer)
+                    part_number += 1
+                    buffer = take_buffer()
+                    filled = 0
+                n = min(len(view), part_size - filled)
+                buffer[filled:filled + n] = view[:n]
+                filled += n
+                view = view[n:]
+
+        # Pyrogram logs and swallows transfer errors, so a failed stream just ends early
+        if streamed != file_size:
+            raise IOError(f"Truncated download: {streamed}/{file_size} bytes")
+
+        last_part = buffer if filled == part_size else buffer[:filled]
+        if not part_tasks:
+            # Single-part file: one PUT saves the create/complete round trips
+            await run_s3(s3_client.put_object, Body=last_part, **UPLOAD_EXTRA_ARGS)
+            progress.add(filled)
+            return
+
+        await submit_part(part_number, last_part)
+        parts = await asyncio.gather(*part_tasks)
+        await run_s3(
+            s3_client.complete_multipart_upload,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        for task in part_tasks:
+            task.cancel()
+        if upload_id is None:
+            raise
+        # A part that lands after the abort would be left behind as billed storage
+        running = [asyncio.wrap_future(future) for future in s3_futures if not future.done()]
+        if running:
+            await asyncio.wait(running)
+        try:
+            await run_s3(s3_client.abort_multipart_upload, UploadId=upload_id)
+        except Exception as abort_error:
+            logger.error(f"Failed to abort multipart upload {upload_id}: {abort_error}")
+        raise
+
+# Strong references keep fire-and-forget tasks alive until they finish
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def remove_file(path):
+    with suppress(OSError):
+        os.remove(path)
+
+# Staged downloads are named "<chat id>_<message id>_<file name>", plus Pyrogram's
+# ".temp" suffix while still in progress
+_STAGED_FILE_RE = re.compile(r'-?\d+_\d+_')
+
+def clear_download_dir():
+    """Delete staged files left behind by a previous run that did not clean up"""
+    try:
+        entries = os.scandir(DOWNLOAD_DIR)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if _STAGED_FILE_RE.match(entry.name) and entry.is_file(follow_symlinks=False):
+                remove_file(entry.path)
+
+# One attribute check per update instead of walking a four-way OR filter tree.
+# Async like Pyrogram's built-in filters: plain functions are run on the
+# client's thread pool for every update.
+async def media_filter_func(_, __, m):
+    return bool(m.document or m.video or m.audio or m.photo)
+
+media_filter = filters.create(media_filter_func, "MediaFilter")
 
 # Rate limiting
-user_requests = defaultdict(list)
+RATE_LIMIT = 5
+RATE_PERIOD = 60
+# user_id -> monotonic times of their recent requests, oldest first
+user_requests = {}
 
-def is_rate_limited(user_id, limit=5, period=60):
-    now = datetime.now()
-    user_requests[user_id] = [req_time for req_time in user_requests[user_id] if now - req_time < timedelta(seconds=period)]
+def is_rate_limited(user_id, limit=RATE_LIMIT, period=RATE_PERIOD):
+    now = time.monotonic()
+    requests_made = user_requests.get(user_id)
+    if requests_made is None:
+        requests_made = user_requests[user_id] = deque(maxlen=limit)
+    while requests_made and now - requests_made[0] >= period:
+        requests_made.popleft()
     
-    if len(user_requests[user_id]) >= limit:
+    if len(requests_made) >= limit:
         return True
     
-    user_requests[user_id].append(now)
+    requests_made.append(now)
     return False
 
+async def sweep_rate_limits(period=RATE_PERIOD):
+    """Forget users with no request inside the window, so one-off users don't pile up"""
+    while True:
+        await asyncio.sleep(period)
+        cutoff = time.monotonic() - period
+        for user_id in [uid for uid, times in user_requests.items() if not times or times[-1] <= cutoff]:
+            del user_requests[user_id]
+
+def command_handler(usage=None):
+    """Apply the shared rate limit, and the argument check when a usage string is given"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(client, message: Message):
+            if is_rate_limited(message.from_user.id):
+                await message.reply_text("Too many requests. Please try again in a minute.")
+                return
+            if usage and len(message.command) < 2:
+                await message.reply_text(f"Usage: {usage}")
+                return
+            return await handler(client, message)
+        return wrapper
+    return decorator
+
 # -----------------------------
 # Bot Handlers
 # -----------------------------
-@app.on_message(filters.command("start"))
+@command_handler()
 async def start_command(client, message: Message):
-    if is_rate_limited(message.from_user.id):
-        await message.reply_text("Too many requests. Please try again in a minute.")
-        return
-        
     await message.reply_text(
         "🚀 Cloud Storage Bot with Web Player\n\n"
         "Send me any file to upload to Wasabi storage\n"
         "Use /download <filename> to download files\n"
         "Use /play <filename> to get web player links\n"
-        "Use /list to see your files\n"
+        "Use /list [page] to see your files\n"
         "Use /delete <filename> to remove files\n\n"
         "<b>⚡ Extreme Performance Features:</b>\n"
         "• 2GB file size support\n"
@@ -240,23 +875,15 @@ async def start_command(client, message: Message):
         "<b>📱 Telegram:</b> @Sathishkumar33"
     )
 
-@app.on_message(filters.document | filters.video | filters.audio | filters.photo)
+@command_handler()
 async def upload_file_handler(client, message: Message):
-    if is_rate_limited(message.from_user.id):
-        await message.reply_text("Too many requests. Please try again in a minute.")
-        return
-        
     media = message.document or message.video or message.audio or message.photo
     if not media:
         await message.reply_text("Unsupported file type")
         return
 
-    # Get file size
-    if message.photo:
-        # For photos, get the largest available size
-        file_size = message.photo.sizes[-1].file_size
-    else:
-        file_size = media.file_size
+    # Pyrogram reports the size of the largest photo variant on Photo itself
+    file_size = media.file_size
     
     # Check file size limit
     if file_size > MAX_FILE_SIZE:
@@ -265,75 +892,77 @@ async def upload_file_handler(client, message: Message):
 
     status_message = await message.reply_text("📥 Downloading...\n[○○○○○○○○○○○○] 0.0%\nProcessed: 0.00B of 0000MB\nSpeed: 0.00B/s | ETA: -\nElapsed: 00s\nUpload: Telegram\nDownload: Wasabi")
 
-    download_start_time = time.time()
-    last_update_time = time.time()
-    processed_bytes = 0
-    last_processed_bytes = 0
     start_time = time.time()
+    download_progress = TransferProgress(status_message, file_size, title="📥 Downloading...")
 
     async def progress_callback(current, total):
-        nonlocal processed_bytes, last_update_time, last_processed_bytes
-        processed_bytes = current
-        current_time = time.time()
-        
-        # Update progress every 1 second to avoid flooding
-        if current_time - last_update_time >= 1:
-            percentage = (current / total) * 100
-            elapsed_time = current_time - start_time
-            
-            # Calculate speed
-            speed = (current - last_processed_bytes) / (current_time - last_update_time)
-            
-            # Calculate ETA
-            if speed > 0:
-                eta = (total - current) / speed
-            else:
-                eta = 0
+        download_progress.set(current)
+
+    file_name = get_media_file_name(message, media)
+    user_file_name = f"{get_user_folder(message.from_user.id)}/{file_name}"
+
+    file_path = None
+    # Signing needs only the key, so it runs while the transfer is in progress
+    presign_task = asyncio.create_task(generate_presigned_url(user_file_name))
+    try:
+        if STREAM_UPLOADS:
+            # Stream Telegram -> Wasabi without a local copy
+            upload_progress = TransferProgress(status_message, file_size, title="🚀 Streaming to Wasabi...")
+            progress_task = asyncio.create_task(upload_progress.pump())
+            try:
+                await stream_to_wasabi(
+                    client, message, user_file_name, upload_progress, file_size,
+                    part_size=stream_part_size(file_size)
+                )
+            finally:
+                progress_task.cancel()
+        else:
+            # Download file with progress callback
+            progress_task = asyncio.create_task(download_progress.pump())
+            try:
+                # Per-message name so concurrent uploads of the same file never collide
+                file_path = await message.download(
+                    file_name=os.path.join(DOWNLOAD_DIR, f"{message.chat.id}_{message.id}_{file_name}"),
+                    progress=progress_callback
+                )
+            finally:
+                progress_task.cancel()
+
+            # One stat for both the existence and the size check
+            try:
+                downloaded_size = os.stat(file_path).st_size
+            except FileNotFoundError:
+                raise RuntimeError("Downloaded file vanished before upload")
+            if downloaded_size != file_size:
+                # Never ship a truncated file to Wasabi
+                raise IOError(f"Truncated download: {downloaded_size}/{file_size} bytes")
             
-            # Format progress message
-            progress_bar = create_progress_bar(percentage)
-            progress_text = (
-                f"📥 Downloading...\n"
-                f"[{progress_bar}] {percentage:.1f}%\n"
-                f"Processed: {humanbytes(current)} of {humanbytes(total)}\n"
-                f"Speed: {humanbytes(speed)}/s | ETA: {format_eta(eta)}\n"
-                f"Elapsed: {format_elapsed(elapsed_time)}\n"
-                f"Upload: Telegram\n"
-                f"Download: Wasabi"
-            )
+            # Update status to uploading
+            await status_message.edit_text("📤 Uploading to Wasabi...")
             
+            # Upload to Wasabi (multipart, parallel parts) on the S3 worker pool
+            upload_progress = TransferProgress(status_message, downloaded_size)
+            progress_task = asyncio.create_task(upload_progress.pump())
+            loop = asyncio.get_running_loop()
             try:
-                await status_message.edit_text(progress_text)
-                last_update_time = current_time
-                last_processed_bytes = current
-            except FloodWait as e:
-                await asyncio.sleep(e.value)
-            except Exception:
-                pass  # Ignore other errors during progress updates
-
-    try:
-        # Download file with progress callback
-        file_path = await message.download(progress=progress_callback)
-        file_name = sanitize_filename(os.path.basename(file_path))
-        user_file_name = f"{get_user_folder(message.from_user.id)}/{file_name}"
+                await loop.run_in_executor(
+                    S3_EXECUTOR,
+                    functools.partial(
+                        get_s3_transfer().upload_file,
+                        file_path,
+                        ENV.wasabi_bucket,
+                        user_file_name,
+                        callback=upload_progress.add,
+                        extra_args=UPLOAD_EXTRA_ARGS
+                    )
+                )
+            finally:
+                progress_task.cancel()
         
-        # Update status to uploading
-        await status_message.edit_text("📤 Uploading to Wasabi...")
-        
-        # Upload to Wasabi
-        await asyncio.to_thread(
-            s3_client.upload_file,
-            file_path,
-            WASABI_BUCKET,
-            user_file_name
-        )
+        add_user_file(message.from_user.id, file_name)
         
         # Generate shareable link
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object', 
-            Params={'Bucket': WASABI_BUCKET, 'Key': user_file_name}, 
-            ExpiresIn=86400
-        )
+        presigned_url, expires_at = await presign_task
         
         # Generate player URL if supported
         player_url = generate_player_url(file_name, presigned_url)
@@ -347,7 +976,7 @@ async def upload_file_handler(client, message: Message):
             f"📁 File: {file_name}\n"
             f"📦 Size: {humanbytes(file_size)}\n"
             f"⏱️ Time: {format_elapsed(total_time)}\n"
-            f"⏰ Link expires: 24 hours"
+            f"⏰ Link expires in: {format_expiry(expires_at)}"
         )
         
         if player_url:
@@ -362,19 +991,17 @@ async def upload_file_handler(client, message: Message):
         logger.error(f"Upload error: {e}")
         await status_message.edit_text(f"❌ Error: {str(e)}")
     finally:
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
+        if presign_task.done():
+            if not presign_task.cancelled():
+                presign_task.exception()  # Mark a failed signing as seen
+        else:
+            presign_task.cancel()
+        if file_path:
+            # Unlink after the reply has gone out, off the event loop
+            run_in_background(asyncio.to_thread(remove_file, file_path))
 
-@app.on_message(filters.command("download"))
+@command_handler(usage="/download <filename>")
 async def download_file_handler(client, message: Message):
-    if is_rate_limited(message.from_user.id):
-        await message.reply_text("Too many requests. Please try again in a minute.")
-        return
-        
-    if len(message.command) < 2:
-        await message.reply_text("Usage: /download <filename>")
-        return
-
     file_name = " ".join(message.command[1:])
     user_file_name = f"{get_user_folder(message.from_user.id)}/{file_name}"
     
@@ -382,14 +1009,12 @@ async def download_file_handler(client, message: Message):
     
     try:
         # Check if file exists
-        s3_client.head_object(Bucket=WASABI_BUCKET, Key=user_file_name)
+        if not await user_has_file(message.from_user.id, file_name):
+            await status_message.edit_text("File not found.")
+            return
         
         # Generate presigned URL
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object', 
-            Params={'Bucket': WASABI_BUCKET, 'Key': user_file_name}, 
-            ExpiresIn=86400
-        )
+        presigned_url, expires_at = await generate_presigned_url(user_file_name)
         
         # Generate player URL if supported
         player_url = generate_player_url(file_name, presigned_url)
@@ -397,7 +1022,7 @@ async def download_file_handler(client, message: Message):
         # Create keyboard with options
         keyboard = create_download_keyboard(presigned_url, player_url)
         
-        response_text = f"📥 Download ready for: {file_name}\n⏰ Link expires: 24 hours"
+        response_text = f"📥 Download ready for: {file_name}\n⏰ Link expires in: {format_expiry(expires_at)}"
         
         if player_url:
             response_text += f"\n\n🎬 Web Player: {player_url}"
@@ -417,34 +1042,26 @@ async def download_file_handler(client, message: Message):
         logger.error(f"Download error: {e}")
         await status_message.edit_text(f"Error: {str(e)}")
 
-@app.on_message(filters.command("play"))
+@command_handler(usage="/play <filename>")
 async def play_file(client, message: Message):
-    if is_rate_limited(message.from_user.id):
-        await message.reply_text("Too many requests. Please try again in a minute.")
-        return
-        
     try:
-        if len(message.command) < 2:
-            await message.reply_text("Please specify a filename. Usage: /play filename")
-            return
-            
         filename = " ".join(message.command[1:])
         user_folder = get_user_folder(message.from_user.id)
         user_file_name = f"{user_folder}/{filename}"
         
+        if not await user_has_file(message.from_user.id, filename):
+            await message.reply_text("File not found.")
+            return
+        
         # Generate a presigned URL
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': WASABI_BUCKET, 'Key': user_file_name},
-            ExpiresIn=86400
-        )
+        presigned_url, expires_at = await generate_presigned_url(user_file_name)
         
         player_url = generate_player_url(filename, presigned_url)
         
         if player_url:
             await message.reply_text(
                 f"Player link for {filename}:\n\n{player_url}\n\n"
-                "This link will expire in 24 hours."
+                f"This link will expire in {format_expiry(expires_at)}."
             )
         else:
             await message.reply_text("This file type doesn't support web playback.")
@@ -452,54 +1069,56 @@ async def play_file(client, message: Message):
     except Exception as e:
         await message.reply_text(f"File not found or error generating player link: {str(e)}")
 
-@app.on_message(filters.command("list"))
+@command_handler()
 async def list_files(client, message: Message):
-    if is_rate_limited(message.from_user.id):
-        await message.reply_text("Too many requests. Please try again in a minute.")
-        return
-        
+    page = 1
+    if len(message.command) > 1:
+        if not message.command[1].isdigit() or int(message.command[1]) < 1:
+            await message.reply_text("Usage: /list [page]")
+            return
+        page = int(message.command[1])
+
     try:
-        user_prefix = get_user_folder(message.from_user.id) + "/"
-        response = s3_client.list_objects_v2(
-            Bucket=WASABI_BUCKET, 
-            Prefix=user_prefix
-        )
+        files = await get_user_files(message.from_user.id)
         
-        if 'Contents' not in response:
+        if not files:
             await message.reply_text("No files found")
             return
         
-        files = [obj['Key'].replace(user_prefix, "") for obj in response['Contents']]
-        files_list = "\n".join([f"• {file}" for file in files[:15]])  # Show first 15 files
+        pages = -(-len(files) // FILES_PER_PAGE)
+        if page > pages:
+            await message.reply_text(f"Page {page} is out of range, you have {pages} page(s)")
+            return
+
+        # Only the shown entries are formatted; the rest are just counted
+        start = (page - 1) * FILES_PER_PAGE
+        files_list = "\n".join(
+            f"• {file}" for file in itertools.islice(files, start, start + FILES_PER_PAGE)
+        )
         
-        if len(files) > 15:
-            files_list += f"\n\n...and {len(files) - 15} more files"
+        if page < pages:
+            files_list += f"\n\n...and {len(files) - start - FILES_PER_PAGE} more files (use /list {page + 1})"
         
-        await message.reply_text(f"📁 Your files:\n\n{files_list}")
+        await message.reply_text(f"📁 Your files (page {page}/{pages}):\n\n{files_list}")
     
     except Exception as e:
         logger.error(f"List files error: {e}")
         await message.reply_text(f"Error: {str(e)}")
 
-@app.on_message(filters.command("delete"))
+@command_handler(usage="/delete <filename>")
 async def delete_file(client, message: Message):
-    if is_rate_limited(message.from_user.id):
-        await message.reply_text("Too many requests. Please try again in a minute.")
-        return
-        
-    if len(message.command) < 2:
-        await message.reply_text("Usage: /delete <filename>")
-        return
-
     file_name = " ".join(message.command[1:])
     user_file_name = f"{get_user_folder(message.from_user.id)}/{file_name}"
     
+    s3_client = get_s3_client()
     try:
         # Delete file from Wasabi
-        s3_client.delete_object(
-            Bucket=WASABI_BUCKET,
+        await asyncio.to_thread(
+            s3_client.delete_object,
+            Bucket=ENV.wasabi_bucket,
             Key=user_file_name
         )
+        remove_user_file(message.from_user.id, file_name)
         
         await message.reply_text(f"✅ Deleted: {file_name}")
     
@@ -507,12 +1126,82 @@ async def delete_file(client, message: Message):
         logger.error(f"Delete error: {e}")
         await message.reply_text(f"Error: {str(e)}")
 
+def register_handlers(app):
+    """Attach the bot's message handlers to a Pyrogram client"""
+    app.add_handler(MessageHandler(start_command, filters.command("start")))
+    app.add_handler(MessageHandler(upload_file_handler, media_filter))
+    app.add_handler(MessageHandler(download_file_handler, filters.command("download")))
+    app.add_handler(MessageHandler(play_file, filters.command("play")))
+    app.add_handler(MessageHandler(list_files, filters.command("list")))
+    app.add_handler(MessageHandler(delete_file, filters.command("delete")))
+
 # -----------------------------
-# Flask Server Startup
+# Startup
 # -----------------------------
-print("Starting Flask server on port 8000...")
-Thread(target=run_flask, daemon=True).start()
+def install_event_loop_policy():
+    """Use uvloop where available; Windows needs the selector loop for Pyrogram"""
+    if os.name == 'nt':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        return
+    try:
+        import uvloop
+    except ImportError:
+        return
+    uvloop.install()
+    logger.info("Using uvloop event loop")
+
+async def run_bot():
+    """Run the bot on the current event loop until interrupted"""
+    # Built inside the running loop so Pyrogram binds to it rather than a loop of its own
+    # A stable, persisted session lets restarts skip the MTProto re-authorization
+    app = Client(
+        ENV.session_name,
+        api_id=ENV.api_id,
+        api_hash=ENV.api_hash,
+        bot_token=ENV.bot_token,
+        workdir=ENV.session_dir,
+        workers=16,
+        max_concurrent_transmissions=TG_CONCURRENT_TRANSMISSIONS,
+        sleep_threshold=30
+    )
+    register_handlers(app)
+
+    await app.start()
+    run_in_background(sweep_rate_limits())
+    try:
+        await idle()
+    finally:
+        await app.stop()
+
+def main():
+    # Validate environment variables before touching Telegram or Wasabi
+    missing_vars = ENV.missing()
+    if missing_vars:
+        raise Exception(f"Missing environment variables: {', '.join(missing_vars)}")
+
+    # Fail now rather than on the first upload
+    if S3_CHECKSUM_ALGORITHM:
+        if S3_CHECKSUM_ALGORITHM not in S3_CHECKSUM_ALGORITHMS:
+            raise Exception(
+                f"Unsupported S3_CHECKSUM_ALGORITHM {S3_CHECKSUM_ALGORITHM}, "
+                f"use one of: {', '.join(S3_CHECKSUM_ALGORITHMS)}"
+            )
+        if S3_CHECKSUM_ALGORITHM == "CRC32C" and importlib.util.find_spec("awscrt") is None:
+            raise Exception("S3_CHECKSUM_ALGORITHM=CRC32C requires boto3[crt] to be installed")
+
+    get_s3_client()
+    if not STREAM_UPLOADS:
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        clear_download_dir()
+
+    print("Starting Flask server on port 8000...")
+    Thread(target=run_flask, daemon=True).start()
+
+    # The loop policy must be set before asyncio.run creates the loop
+    install_event_loop_policy()
 
-if __name__ == "__main__":
     print("Starting Wasabi Storage Bot with Web Player...")
-    app.run()
+    asyncio.run(run_bot())
+
+if __name__ == "__main__":
+    main()